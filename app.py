@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
+import atexit
+import logging
 import os
-import json
+import orjson  # Fast JSON encoding/decoding
 import pigpio  # GPIO control
+import signal
+import sys
+import threading
 import time
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, make_response, Response
+from flask.json.provider import JSONProvider
 from network import random_mac, get_current_mac, get_current_ssid, get_available_networks, get_ap_status, update_hostapd_config
 
+log = logging.getLogger(__name__)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = '3333'  # Change to a secure secret key in production
 
 # Set a password for WiFi authentication
@@ -16,89 +35,170 @@ WIFI_PASSWORD = "3333"
 # Define a configuration file to store flowmeter settings
 FLOWMETER_CONFIG_FILE = "flowmeter_config.json"
 
+# Parsed flowmeter config, kept in memory after the first load
+_CONFIG_CACHE = None
+
+# Seconds to wait for further edits before writing the config to disk. A
+# pending write is flushed on normal exit and on SIGTERM (systemctl stop or
+# restart), but edits made within this window are lost on power loss or
+# SIGKILL.
+CONFIG_SAVE_DELAY = 1.0
+_SAVE_LOCK = threading.Lock()
+_SAVE_TIMER = None
+
 # GPIO Pin for Flowmeter Sensor (change based on your wiring)
 FLOWMETER_GPIO = 17  # Example GPIO pin
 
-# Flowmeter pulse count and conversion factor
-PULSE_COUNT = 0
+# Flowmeter conversion factor
 PULSE_TO_LITER = 0.0025  # Adjust based on flowmeter specs
 
+# Maximum rate (seconds between checks) for pushing liters over /stream
+STREAM_INTERVAL = 0.2
+# Send an SSE comment this often. A client that closes its connection
+# cleanly is noticed on the next write, freeing its thread within a second.
+STREAM_KEEPALIVE = 1
+# A client that silently vanishes (e.g. a phone leaving the AP) causes no
+# write error until TCP gives up, so streams end after this many seconds
+# and the browser reconnects after STREAM_RETRY_MS.
+STREAM_MAX_AGE = 300
+STREAM_RETRY_MS = 3000
+# Each open /stream holds a waitress thread, so cap them below the thread
+# count; clients over the cap get a 503 and fall back to polling /get_liters
+MAX_STREAMS = 4
+_STREAM_SLOTS = threading.BoundedSemaphore(MAX_STREAMS)
+
+# Edges must be stable this long (microseconds) to be counted; filters bounce
+DEBOUNCE_US = 500
+
+# Worker threads for gathering network info in parallel
+_NET_POOL = ThreadPoolExecutor(max_workers=4)
+
 # Initialize pigpio
 pi = pigpio.pi()
 if not pi.connected:
-    print("Error: Cannot connect to pigpio. Is pigpiod running?")
+    log.error("Cannot connect to pigpio. Is pigpiod running?")
     exit(1)
 
-def flowmeter_callback(gpio, level, tick):
-    """Callback function for counting flowmeter pulses."""
-    global PULSE_COUNT
-    if level == 1:  # Count only rising edge pulses
-        PULSE_COUNT += 1
-
-# Attach callback to the GPIO pin
+# Attach a tally callback to the GPIO pin. Without a callable, pigpio's own
+# _tally method counts rising edges on its notification thread.
 pi.set_mode(FLOWMETER_GPIO, pigpio.INPUT)
 pi.set_pull_up_down(FLOWMETER_GPIO, pigpio.PUD_DOWN)
-pi.callback(FLOWMETER_GPIO, pigpio.RISING_EDGE, flowmeter_callback)
+pi.set_glitch_filter(FLOWMETER_GPIO, DEBOUNCE_US)
+flowmeter_cb = pi.callback(FLOWMETER_GPIO, pigpio.RISING_EDGE)
+
+def pulses_to_liters(pulses):
+    """Convert a pulse count to liters."""
+    return round(pulses * PULSE_TO_LITER, 3)
 
 def get_liters_flowed():
     """Convert pulses to liters flowed."""
-    return round(PULSE_COUNT * PULSE_TO_LITER, 3)
+    return pulses_to_liters(flowmeter_cb.tally())
 
 def reset_flowmeter():
     """Reset the pulse count."""
-    global PULSE_COUNT
-    PULSE_COUNT = 0
+    flowmeter_cb.reset_tally()
 
 def load_flowmeter_config():
-    """Load the flowmeter configuration from file."""
+    """Load the flowmeter configuration, reading the file only on first use."""
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is not None:
+        return dict(_CONFIG_CACHE)
+
     default_config = {"density": "", "magnet_offset": ""}
     if os.path.exists(FLOWMETER_CONFIG_FILE):
         try:
-            with open(FLOWMETER_CONFIG_FILE, "r") as f:
-                config = json.load(f)
+            with open(FLOWMETER_CONFIG_FILE, "rb") as f:
+                config = orjson.loads(f.read())
                 for key in default_config:
                     if key not in config:
                         config[key] = default_config[key]
-                return config
+                _CONFIG_CACHE = config
+                return dict(config)
         except Exception as e:
-            print("Error loading flowmeter config:", e)
-    return default_config
+            log.error("Error loading flowmeter config: %s", e)
+            return default_config
+    _CONFIG_CACHE = default_config
+    return dict(default_config)
 
 def save_flowmeter_config(config):
-    """Save the flowmeter configuration to file."""
-    try:
-        with open(FLOWMETER_CONFIG_FILE, "w") as f:
-            json.dump(config, f, indent=4)
-    except Exception as e:
-        print("Error saving flowmeter config:", e)
+    """Update the flowmeter configuration and schedule a write, coalescing rapid saves."""
+    global _CONFIG_CACHE, _SAVE_TIMER
+    with _SAVE_LOCK:
+        _CONFIG_CACHE = dict(config)
+        if _SAVE_TIMER is not None:
+            _SAVE_TIMER.cancel()
+        _SAVE_TIMER = threading.Timer(CONFIG_SAVE_DELAY, _write_flowmeter_config)
+        _SAVE_TIMER.daemon = True
+        _SAVE_TIMER.start()
+
+def _write_flowmeter_config():
+    """Write a pending flowmeter configuration to file atomically."""
+    global _SAVE_TIMER
+    with _SAVE_LOCK:
+        if _SAVE_TIMER is None:
+            return
+        _SAVE_TIMER.cancel()
+        _SAVE_TIMER = None
+        temp_file = FLOWMETER_CONFIG_FILE + ".tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                f.write(orjson.dumps(_CONFIG_CACHE, option=orjson.OPT_INDENT_2))
+            os.replace(temp_file, FLOWMETER_CONFIG_FILE)
+        except Exception as e:
+            log.error("Error saving flowmeter config: %s", e)
+
+# Flush any pending config write on interpreter exit; see handle_sigterm
+atexit.register(_write_flowmeter_config)
+
+def handle_sigterm(signum, frame):
+    """Exit through sys.exit so atexit handlers, including the config flush, run."""
+    sys.exit(0)
+
+def get_network_info():
+    """Collect the network details shown on the dashboard, running the lookups concurrently."""
+    mac = _NET_POOL.submit(get_current_mac)
+    ssid = _NET_POOL.submit(get_current_ssid)
+    networks = _NET_POOL.submit(get_available_networks)
+    ap = _NET_POOL.submit(get_ap_status)
+    ap_status, ap_ssid = ap.result()
+    return {
+        "current_mac": mac.result(),
+        "current_ssid": ssid.result(),
+        "available_networks": networks.result(),
+        "ap_status": ap_status,
+        "ap_ssid": ap_ssid
+    }
+
+# Endpoints that change the AP configuration and need WiFi authentication
+WIFI_AUTH_ENDPOINTS = {'wifi_settings', 'update_ap'}
+
+@app.before_request
+def require_wifi_auth():
+    """Redirect unauthenticated users away from WiFi settings before any work is done."""
+    if request.endpoint in WIFI_AUTH_ENDPOINTS and not session.get('wifi_authenticated'):
+        return redirect(url_for('wifi_auth'))
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     """Main dashboard page."""
+    # If reset button is pressed, reset the flowmeter counter; no config needed
+    if request.method == 'POST' and 'reset_flow' in request.form:
+        reset_flowmeter()
+        return redirect(url_for('index'))
+
     config = load_flowmeter_config()
 
     if request.method == 'POST':
-        # If reset button is pressed, reset the flowmeter counter
-        if 'reset_flow' in request.form:
-            reset_flowmeter()
-        else:
-            # Otherwise update the flowmeter settings (density & magnet_offset)
-            density = request.form.get('density', '')
-            magnet_offset = request.form.get('magnet_offset', '')
-            config['density'] = density
-            config['magnet_offset'] = magnet_offset
-            save_flowmeter_config(config)
+        # Otherwise update the flowmeter settings (density & magnet_offset)
+        density = request.form.get('density', '')
+        magnet_offset = request.form.get('magnet_offset', '')
+        config['density'] = density
+        config['magnet_offset'] = magnet_offset
+        save_flowmeter_config(config)
         return redirect(url_for('index'))
 
-    current_mac = get_current_mac()
-    current_ssid = get_current_ssid()
-    available_networks = get_available_networks()
-    ap_status, ap_ssid = get_ap_status()
-    
+    # The dashboard shows no network info, so don't gather any for it
     return render_template("index.html", config=config,
-                           current_mac=current_mac, current_ssid=current_ssid,
-                           available_networks=available_networks,
-                           ap_status=ap_status, ap_ssid=ap_ssid,
                            liters=get_liters_flowed())
 
 @app.route('/wifi-auth', methods=['GET', 'POST'])
@@ -116,54 +216,97 @@ def wifi_auth():
 
 @app.route('/wifi-settings', methods=['GET', 'POST'])
 def wifi_settings():
-    """WiFi Settings Page (requires authentication)."""
-    if 'wifi_authenticated' not in session or not session['wifi_authenticated']:
-        return redirect(url_for('wifi_auth'))
-    
+    """WiFi Settings Page (authentication is enforced by require_wifi_auth)."""
     if request.method == 'POST':
         new_ssid = request.form.get('ap_ssid', '').strip()
         new_password = request.form.get('ap_password', '').strip()
         if new_ssid and new_password:
             success = update_hostapd_config(new_ssid, new_password)
-            print("WiFi updated." if success else "WiFi update failed.")
+            if success:
+                log.info("WiFi updated.")
+            else:
+                log.warning("WiFi update failed.")
         else:
-            print("SSID and password cannot be empty.")
+            log.warning("SSID and password cannot be empty.")
         return redirect(url_for('wifi_settings'))
 
-    return render_template("wifi_settings.html",
-                           current_mac=get_current_mac(),
-                           current_ssid=get_current_ssid(),
-                           available_networks=get_available_networks(),
-                           ap_status=get_ap_status()[0],
-                           ap_ssid=get_ap_status()[1])
+    return render_template("wifi_settings.html", **get_network_info())
 
 @app.route('/update_ap', methods=['POST'])
 def update_ap():
-    """Update WiFi settings (alternative endpoint)."""
+    """Update WiFi settings (alternative endpoint, requires authentication)."""
     new_ssid = request.form.get('ap_ssid', '').strip()
     new_password = request.form.get('ap_password', '').strip()
     if new_ssid and new_password:
         success = update_hostapd_config(new_ssid, new_password)
-        print("AP settings updated successfully." if success else "Failed to update AP settings.")
+        if success:
+            log.info("AP settings updated successfully.")
+        else:
+            log.warning("Failed to update AP settings.")
     else:
-        print("SSID and password cannot be empty.")
+        log.warning("SSID and password cannot be empty.")
     return redirect(url_for('index'))
 
+@app.route('/status', methods=['GET'])
+def status():
+    """Return liters flowed and network info in one JSON response."""
+    return jsonify(liters=get_liters_flowed(), **get_network_info())
+
 @app.route('/network_info', methods=['GET'])
 def network_info():
     """Return network info as JSON."""
-    return jsonify({
-        "current_mac": get_current_mac(),
-        "current_ssid": get_current_ssid(),
-        "available_networks": get_available_networks(),
-        "ap_status": get_ap_status()[0],
-        "ap_ssid": get_ap_status()[1]
-    })
+    return jsonify(get_network_info())
 
 @app.route('/get_liters', methods=['GET'])
 def get_liters():
-    """Return current liters flowed as JSON."""
-    return jsonify({"liters": get_liters_flowed()})
+    """Return current liters flowed as JSON, or 304 if the pulse count is unchanged."""
+    pulses = flowmeter_cb.tally()
+    etag = str(pulses)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({"liters": pulses_to_liters(pulses)})
+    response.set_etag(etag)
+    return response
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """Push liters flowed as server-sent events whenever the pulse count changes."""
+    if not _STREAM_SLOTS.acquire(blocking=False):
+        return Response("Too many open streams", status=503,
+                        headers={'Retry-After': '10'})
+
+    def events():
+        last_pulses = None
+        last_sent = time.monotonic()
+        deadline = last_sent + STREAM_MAX_AGE
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            pulses = flowmeter_cb.tally()
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if pulses != last_pulses:
+                last_pulses = pulses
+                last_sent = now
+                yield f"data: {pulses_to_liters(pulses)}\n\n"
+            elif now - last_sent >= STREAM_KEEPALIVE:
+                last_sent = now
+                yield ": keepalive\n\n"
+            time.sleep(STREAM_INTERVAL)
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    response.call_on_close(_STREAM_SLOTS.release)
+    return response
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=3333)
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    # atexit does not run on SIGTERM by default, and waitress installs no handler
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    # Waitress keeps HTTP/1.1 connections alive and serves requests from a
+    # thread pool, unlike the Flask dev server. At most MAX_STREAMS threads
+    # are held by /stream, leaving the rest for the regular endpoints.
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=3333, threads=8, connection_limit=64)
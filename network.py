@@ -8,14 +8,51 @@ information, listing available networks, checking the AP status, and updating
 the hostapd configuration.
 """
 
+import functools
+import logging
 import os
 import random
+import shutil
 import subprocess
-import re
+import time
+
+log = logging.getLogger(__name__)
 
 # Constant for hostapd configuration file (adjust the path as needed)
 HOSTAPD_CONF = '/etc/hostapd/hostapd.conf'
 
+# SSID parsed from HOSTAPD_CONF; refreshed by update_hostapd_config
+_HOSTAPD_SSID_CACHE = None
+
+
+def ttl_cache(seconds=2):
+    """
+    Memoize a function's result for a short time, keyed by its arguments.
+
+    Args:
+        seconds (float): How long a cached result stays valid.
+
+    Returns:
+        callable: A decorator. The wrapped function gains a cache_clear() method.
+    """
+    def decorator(func):
+        cache = {}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            entry = cache.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+            value = func(*args, **kwargs)
+            cache[key] = (value, now + seconds)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
 
 def random_mac():
     """
@@ -33,9 +70,10 @@ def random_mac():
     return ':'.join(f"{byte:02x}" for byte in mac)
 
 
+@ttl_cache(seconds=2)
 def get_current_mac(interface='wlan0'):
     """
-    Retrieve the current MAC address of the specified network interface.
+    Retrieve the current MAC address of the specified network interface from sysfs.
 
     Args:
         interface (str): The network interface (default 'wlan0').
@@ -44,19 +82,19 @@ def get_current_mac(interface='wlan0'):
         str: The MAC address or "Unknown" if not found.
     """
     try:
-        result = subprocess.check_output(['ip', 'link', 'show', interface], text=True)
-        match = re.search(r"link/ether ([0-9a-f:]{17})", result)
-        if match:
-            return match.group(1)
-        else:
-            print(f"Could not parse MAC address for interface {interface}.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running 'ip' command: {e}")
+        with open(f'/sys/class/net/{interface}/address', 'r') as f:
+            mac = f.read().strip()
+        if mac:
+            return mac
+        log.warning("Could not read MAC address for interface %s.", interface)
+    except FileNotFoundError:
+        log.warning("Interface %s not found.", interface)
     except Exception as e:
-        print(f"Error retrieving current MAC: {e}")
+        log.error("Error retrieving current MAC: %s", e)
     return "Unknown"
 
 
+@ttl_cache(seconds=2)
 def get_current_ssid():
     """
     Get the currently connected Wi-Fi SSID using nmcli.
@@ -72,10 +110,11 @@ def get_current_ssid():
                 if len(parts) > 1:
                     return parts[1]
     except subprocess.CalledProcessError as e:
-        print(f"Error getting current SSID: {e}")
+        log.error("Error getting current SSID: %s", e)
     return "Unknown"
 
 
+@ttl_cache(seconds=2)
 def get_available_networks():
     """
     Retrieve a list of available Wi-Fi SSIDs using nmcli.
@@ -88,20 +127,25 @@ def get_available_networks():
         ssids = list(filter(None, result.splitlines()))
         return sorted(set(ssids))
     except subprocess.CalledProcessError as e:
-        print(f"Error getting available networks: {e}")
+        log.error("Error getting available networks: %s", e)
     return []
 
 
+@ttl_cache(seconds=2)
 def get_ap_status():
     """
-    Check if the 'wlan0_ap' interface is active and retrieve the SSID from hostapd.conf.
+    Check if the 'wlan0_ap' interface is up (via sysfs) and retrieve the SSID from hostapd.conf.
 
     Returns:
         tuple: (status (bool), ssid (str))
     """
+    global _HOSTAPD_SSID_CACHE
     try:
-        result = subprocess.check_output(['ip', 'addr', 'show', 'wlan0_ap'], text=True)
-        if 'state UP' in result:
+        with open('/sys/class/net/wlan0_ap/operstate', 'r') as f:
+            state = f.read().strip()
+        if state == 'up':
+            if _HOSTAPD_SSID_CACHE is not None:
+                return True, _HOSTAPD_SSID_CACHE
             ssid = ''
             try:
                 with open(HOSTAPD_CONF, 'r') as f:
@@ -109,12 +153,13 @@ def get_ap_status():
                         if line.startswith('ssid='):
                             ssid = line.split('=')[1].strip()
                             break
+                _HOSTAPD_SSID_CACHE = ssid
             except Exception as e:
-                print(f"Error reading hostapd config: {e}")
+                log.error("Error reading hostapd config: %s", e)
             return True, ssid
         return False, ''
-    except subprocess.CalledProcessError as e:
-        print(f"Error checking wlan0_ap status: {e}")
+    except OSError as e:
+        log.error("Error checking wlan0_ap status: %s", e)
         return False, ''
 
 
@@ -129,7 +174,9 @@ def update_hostapd_config(new_ssid, new_password):
     Returns:
         bool: True if the configuration update and service restart succeeded; False otherwise.
     """
-    temp_file = '/tmp/hostapd_temp.conf'
+    global _HOSTAPD_SSID_CACHE
+    # Write next to the target so os.replace() is an atomic rename
+    temp_file = HOSTAPD_CONF + '.tmp'
     try:
         with open(HOSTAPD_CONF, 'r') as f:
             lines = f.readlines()
@@ -143,35 +190,34 @@ def update_hostapd_config(new_ssid, new_password):
             else:
                 updated_lines.append(line)
 
+        # Make sure both entries are present before touching the real file
+        if f'ssid={new_ssid}\n' not in updated_lines or f'wpa_passphrase={new_password}\n' not in updated_lines:
+            log.error("ssid or wpa_passphrase entry missing from %s.", HOSTAPD_CONF)
+            return False
+
         with open(temp_file, 'w') as f:
+            # Keep the original permissions before writing the WPA passphrase
+            shutil.copymode(HOSTAPD_CONF, temp_file)
             f.writelines(updated_lines)
 
         # Replace the hostapd configuration file
-        result = subprocess.run(['sudo', 'mv', temp_file, HOSTAPD_CONF], check=False)
-        if result.returncode != 0:
-            print("Failed to replace the hostapd.conf file.")
-            return False
-
-        # Verify that the changes were written
-        with open(HOSTAPD_CONF, 'r') as f:
-            updated_content = f.read()
-            if f"ssid={new_ssid}" not in updated_content or f"wpa_passphrase={new_password}" not in updated_content:
-                print("Error: Changes were not successfully written to hostapd.conf.")
-                return False
+        os.replace(temp_file, HOSTAPD_CONF)
+        _HOSTAPD_SSID_CACHE = new_ssid
+        get_ap_status.cache_clear()
 
         # Restart hostapd to apply the changes
-        subprocess.run(['sudo', 'systemctl', 'restart', 'hostapd'], check=True)
-        print(f"Successfully updated {HOSTAPD_CONF} with SSID '{new_ssid}' and restarted hostapd.")
+        subprocess.run(['systemctl', 'restart', 'hostapd'], check=True)
+        log.info("Successfully updated %s with SSID '%s' and restarted hostapd.", HOSTAPD_CONF, new_ssid)
         return True
 
     except FileNotFoundError:
-        print(f"Error: {HOSTAPD_CONF} not found.")
+        log.error("%s not found.", HOSTAPD_CONF)
     except PermissionError:
-        print(f"Error: Permission denied when writing to {HOSTAPD_CONF}.")
+        log.error("Permission denied when writing to %s.", HOSTAPD_CONF)
     except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {e}")
+        log.error("Error executing command: %s", e)
     except Exception as e:
-        print(f"Unexpected error: {e}")
+        log.error("Unexpected error: %s", e)
     finally:
         if os.path.exists(temp_file):
             os.remove(temp_file)